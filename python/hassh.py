@@ -6,12 +6,19 @@
 # or https://opensource.org/licenses/BSD-3-Clause
 
 import argparse
+import atexit
+import functools
+import multiprocessing
 import pyshark
 import os
+import ssh_kex_parse
 import json
 import logging
-import textwrap
+import queue
+from collections import OrderedDict
 from hashlib import md5
+from logging.handlers import QueueHandler, QueueListener
+from operator import itemgetter
 
 __author__ = "Adel '0x4D31' Karimi"
 __email__ = "akarimishiraz@salesforce.com"
@@ -21,11 +28,50 @@ __license__ = "BSD 3-Clause License"
 __credits__ = ["Ben Reardon", "Adel Karimi", "John B. Althouse",
                "Jeff Atkinson", "Josh Atkins"]
 
+# hassh is a fingerprint, not a security control: let FIPS/OpenSSL 3
+# builds use their non-security md5 (Python 3.9+)
+try:
+    md5(usedforsecurity=False)
+    fingerprint_md5 = functools.partial(md5, usedforsecurity=False)
+except TypeError:
+    fingerprint_md5 = md5
+
+try:
+    import orjson
+
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_dumps = json.dumps
+
 HASSH_VERSION = '1.0'
+KEXINIT_MESSAGE_CODE = '20'
 CAP_BPF_FILTER = 'tcp port 22 or tcp port 2222'
+# Only pass SSH identification strings and KEXINIT msgs up from tshark
+CAP_DISPLAY_FILTER = 'ssh.protocol || ssh.message_code == 20'
 DECODE_AS = {'tcp.port==2222': 'ssh'}
+PCAP_EXTENSIONS = ('.pcap', '.pcapng', '.cap')
+RETRANSMISSION_FIELDS = frozenset(('analysis_retransmission',
+                                   'analysis_spurious_retransmission'))
+
+CSV_HEADER = ("timestamp,sourceIp,destinationIp,sourcePort,"
+              "destinationPort,hasshType,identificationString,"
+              "hassh,hasshVersion,hasshAlgorithms,kexAlgs,encAlgs,"
+              "macAlgs,cmpAlgs")
+# Record fields of the CSV output, in CSV_HEADER order
+CLIENT_CSV_FIELDS = itemgetter(
+    'timestamp', 'sourceIp', 'destinationIp', 'sourcePort',
+    'destinationPort', 'client', 'hassh', 'hasshAlgorithms',
+    'ckex', 'ceacts', 'cmacts', 'ccacts')
+SERVER_CSV_FIELDS = itemgetter(
+    'timestamp', 'sourceIp', 'destinationIp', 'sourcePort',
+    'destinationPort', 'server', 'hasshServer', 'hasshServerAlgorithms',
+    'skex', 'seastc', 'smastc', 'scastc')
+
+# Maximum number of identification strings kept for correlation (LRU)
+PROTOCOL_DICT_SIZE = 10000
 
-protocol_dict = {}
+protocol_dict = OrderedDict()
 
 
 class color:
@@ -36,97 +82,104 @@ class color:
     END = '\033[0m'
 
 
-def process_packet(packet, logf, fingerprint, pout):
-    logger = logging.getLogger()
+COLORS = dict(cl1=color.CL1, cl1e=color.END,
+              cl2=color.CL2, cl2e=color.END,
+              cl3=color.CL3, cl3e=color.END,
+              cl4=color.CL4, cl4e=color.END)
+
+CLIENT_TEMPLATE = (
+    '[+] Client SSH_MSG_KEXINIT detected\n'
+    '    {cl1}[ {sourceIp}:{sourcePort} -> '
+    '{destinationIp}:{destinationPort} ]{cl1e}\n'
+    '        [-] Identification String: {cl2}{client}{cl2e}\n'
+    '        [-] hassh: {cl2}{hassh}{cl2e}\n'
+    '        [-] hassh Algorithms: {cl3}{hasshAlgorithms}{cl3e}')
+
+SERVER_TEMPLATE = (
+    '[+] Server SSH_MSG_KEXINIT detected\n'
+    '    {cl1}[ {sourceIp}:{sourcePort} -> '
+    '{destinationIp}:{destinationPort} ]{cl1e}\n'
+    '        [-] Identification String: {cl4}{server}{cl4e}\n'
+    '        [-] hasshServer: {cl4}{hasshServer}{cl4e}\n'
+    '        [-] hasshServer Algorithms: {cl3}{hasshServerAlgorithms}{cl3e}')
+
+
+def process_packet(packet, fingerprint):
+    """returns the HASSH record (or event) of a packet, if any"""
     global protocol_dict
 
     if not packet.highest_layer == 'SSH':
-        return
+        return None
+    ssh = packet.ssh
+    tcp = packet.tcp
+    sport = tcp.srcport
+    dport = tcp.dstport
     # Extract SSH identification string and correlate with KEXINIT msg
-    if 'protocol' in packet.ssh.field_names:
-        protocol = packet.ssh.protocol
+    protocol = getattr(ssh, 'protocol', None)
+    if protocol is not None:
         srcip = packet.ip.src
         dstip = packet.ip.dst
-        sport = packet.tcp.srcport
-        dport = packet.tcp.srcport
-        key = '{}:{}_{}:{}'.format(srcip, sport, dstip, dport)
+        key = (srcip, sport, dstip, dport)
         protocol_dict[key] = protocol
-    if 'message_code' not in packet.ssh.field_names:
-        return
-    if packet.ssh.message_code != '20':
-        return
-    if ("analysis_retransmission" in packet.tcp.field_names or
-       "analysis_spurious_retransmission" in packet.tcp.field_names):
-        event = event_log(packet, event="retransmission")
+        protocol_dict.move_to_end(key)
+        if len(protocol_dict) > PROTOCOL_DICT_SIZE:
+            protocol_dict.popitem(last=False)
+    if getattr(ssh, 'message_code', None) != KEXINIT_MESSAGE_CODE:
+        return None
+    if RETRANSMISSION_FIELDS.intersection(tcp.field_names):
+        return event_log(packet, event="retransmission")
+    sp = int(sport)
+    dp = int(dport)
+    # Client HASSH if srcport > dstport, Server HASSH if srcport < dstport
+    handler = HASSH_HANDLERS[fingerprint][(sp > dp) - (sp < dp) + 1]
+    if handler is None:
+        return None
+    return handler(packet)
+
+
+def process_pcap_file(pcap, fingerprint):
+    """yields the HASSH records and events of a pcap file"""
+    process = process_packet
+    for packet in ssh_kex_parse.read_pcap(pcap):
+        record = process(packet, fingerprint)
+        if record:
+            yield record
+
+
+def pcap_file_records(pcap, fingerprint):
+    """returns the HASSH records and events of a pcap file as a list
+    (used by the directory mode worker processes)
+    """
+    records = []
+    try:
+        for record in process_pcap_file(pcap, fingerprint):
+            records.append(record)
+    except Exception as e:
+        print('Error: {}'.format(e))
+    return records
+
+
+def output_record(record, logf, pout):
+    """log and optionally print a HASSH record (or event)"""
+    logger = logging.getLogger()
+    if 'eventType' in record:
+        # Events are only reported in JSON output
         if logf == 'json':
-            logger.info(json.dumps(event))
+            logger.info(json_dumps(record))
         return
-    # Client HASSH
-    if ((fingerprint == 'client' or fingerprint == 'all')
-            and int(packet.tcp.srcport) > int(packet.tcp.dstport)):
-        record = client_hassh(packet)
-        if logf == 'json':
-            logger.info(json.dumps(record))
-        elif logf == 'csv':
-            csv_record = csv_logging(record)
-            logger.info(csv_record)
-        # Print the result
-        if not pout:
-            return
-        tmp = textwrap.dedent("""\
-            [+] Client SSH_MSG_KEXINIT detected
-                {cl1}[ {sip}:{sport} -> {dip}:{dport} ]{cl1e}
-                    [-] Identification String: {cl2}{proto}{cl2e}
-                    [-] hassh: {cl2}{hassh}{cl2e}
-                    [-] hassh Algorithms: {cl3}{hasshv}{cl3e}""")
-        tmp = tmp.format(
-            cl1=color.CL1,
-            sip=record['sourceIp'],
-            sport=record['sourcePort'],
-            dip=record['destinationIp'],
-            dport=record['destinationPort'],
-            cl1e=color.END,
-            cl2=color.CL2,
-            hassh=record['hassh'],
-            cl2e=color.END,
-            cl3=color.CL3,
-            hasshv=record['hasshAlgorithms'],
-            cl3e=color.END,
-            proto=record['client'])
-        print(tmp)
-    # Server HASSH
-    elif ((fingerprint == 'server' or fingerprint == 'all')
-            and int(packet.tcp.srcport) < int(packet.tcp.dstport)):
-        record = server_hassh(packet)
-        if logf == 'json':
-            logger.info(json.dumps(record))
-        elif logf == 'csv':
-            csv_record = csv_logging(record)
-            logger.info(csv_record)
-        # Print the result
-        if not pout:
-            return
-        tmp = textwrap.dedent("""\
-            [+] Server SSH_MSG_KEXINIT detected
-                {cl1}[ {sip}:{sport} -> {dip}:{dport} ]{cl1e}
-                    [-] Identification String: {cl4}{proto}{cl4e}
-                    [-] hasshServer: {cl4}{hasshs}{cl4e}
-                    [-] hasshServer Algorithms: {cl3}{hasshsv}{cl3e}""")
-        tmp = tmp.format(
-            cl1=color.CL1,
-            sip=record['sourceIp'],
-            sport=record['sourcePort'],
-            dip=record['destinationIp'],
-            dport=record['destinationPort'],
-            cl1e=color.END,
-            cl4=color.CL4,
-            hasshs=record['hasshServer'],
-            cl4e=color.END,
-            cl3=color.CL3,
-            hasshsv=record['hasshServerAlgorithms'],
-            cl3e=color.END,
-            proto=record['server'])
-        print(tmp)
+    if logf == 'json':
+        logger.info(json_dumps(record))
+    elif logf == 'csv':
+        csv_record = csv_logging(record)
+        logger.info(csv_record)
+    # Print the result
+    if not pout:
+        return
+    # The templates refer to the record keys directly
+    if 'hassh' in record:
+        print(CLIENT_TEMPLATE.format(**COLORS, **record))
+    elif 'hasshServer' in record:
+        print(SERVER_TEMPLATE.format(**COLORS, **record))
 
 
 def event_log(packet, event):
@@ -144,50 +197,47 @@ def event_log(packet, event):
     return msg
 
 
+def hassh_digest(kex, eacts, macts, cacts):
+    """returns the hassh algorithms string and its md5 digest"""
+    algorithms = ';'.join((kex, eacts, macts, cacts))
+    return algorithms, fingerprint_md5(algorithms.encode()).hexdigest()
+
+
 def client_hassh(packet):
     """returns HASSH (i.e. SSH Client Fingerprint)
     HASSH = md5(KEX;EACTS;MACTS;CACTS)
     """
-    srcip = packet.ip.src
-    dstip = packet.ip.dst
-    sport = packet.tcp.srcport
-    dport = packet.tcp.srcport
+    ip = packet.ip
+    tcp = packet.tcp
+    srcip = ip.src
+    dstip = ip.dst
+    sport = tcp.srcport
+    dport = tcp.dstport
     protocol = None
-    key = '{}:{}_{}:{}'.format(srcip, sport, dstip, dport)
+    key = (srcip, sport, dstip, dport)
     if key in protocol_dict:
         protocol = protocol_dict[key]
+        protocol_dict.move_to_end(key)
+    ssh = packet.ssh
     # hassh fields
-    ckex = ceacts = cmacts = ccacts = ""
-    if 'kex_algorithms' in packet.ssh.field_names:
-        ckex = packet.ssh.kex_algorithms
-    if 'encryption_algorithms_client_to_server' in packet.ssh.field_names:
-        ceacts = packet.ssh.encryption_algorithms_client_to_server
-    if 'mac_algorithms_client_to_server' in packet.ssh.field_names:
-        cmacts = packet.ssh.mac_algorithms_client_to_server
-    if 'compression_algorithms_client_to_server' in packet.ssh.field_names:
-        ccacts = packet.ssh.compression_algorithms_client_to_server
+    ckex = getattr(ssh, 'kex_algorithms', '')
+    ceacts = getattr(ssh, 'encryption_algorithms_client_to_server', '')
+    cmacts = getattr(ssh, 'mac_algorithms_client_to_server', '')
+    ccacts = getattr(ssh, 'compression_algorithms_client_to_server', '')
     # Log other kexinit fields (only in JSON)
-    clcts = clstc = ceastc = cmastc = ccastc = cshka = ""
-    if 'languages_client_to_server' in packet.ssh.field_names:
-        clcts = packet.ssh.languages_client_to_server
-    if 'languages_server_to_client' in packet.ssh.field_names:
-        clstc = packet.ssh.languages_server_to_client
-    if 'encryption_algorithms_server_to_client' in packet.ssh.field_names:
-        ceastc = packet.ssh.encryption_algorithms_server_to_client
-    if 'mac_algorithms_server_to_client' in packet.ssh.field_names:
-        cmastc = packet.ssh.mac_algorithms_server_to_client
-    if 'compression_algorithms_server_to_client' in packet.ssh.field_names:
-        ccastc = packet.ssh.compression_algorithms_server_to_client
-    if 'server_host_key_algorithms' in packet.ssh.field_names:
-        cshka = packet.ssh.server_host_key_algorithms
+    clcts = getattr(ssh, 'languages_client_to_server', '')
+    clstc = getattr(ssh, 'languages_server_to_client', '')
+    ceastc = getattr(ssh, 'encryption_algorithms_server_to_client', '')
+    cmastc = getattr(ssh, 'mac_algorithms_server_to_client', '')
+    ccastc = getattr(ssh, 'compression_algorithms_server_to_client', '')
+    cshka = getattr(ssh, 'server_host_key_algorithms', '')
     # Create hassh
-    hassh_str = ';'.join([ckex, ceacts, cmacts, ccacts])
-    hassh = md5(hassh_str.encode()).hexdigest()
+    hassh_str, hassh = hassh_digest(ckex, ceacts, cmacts, ccacts)
     record = {"timestamp": packet.sniff_time.isoformat(),
-              "sourceIp": packet.ip.src,
-              "destinationIp": packet.ip.dst,
-              "sourcePort": packet.tcp.srcport,
-              "destinationPort": packet.tcp.dstport,
+              "sourceIp": srcip,
+              "destinationIp": dstip,
+              "sourcePort": sport,
+              "destinationPort": dport,
               "client": protocol,
               "hassh": hassh,
               "hasshAlgorithms": hassh_str,
@@ -209,46 +259,37 @@ def server_hassh(packet):
     """returns HASSHServer (i.e. SSH Server Fingerprint)
     HASSHServer = md5(KEX;EASTC;MASTC;CASTC)
     """
-    srcip = packet.ip.src
-    dstip = packet.ip.dst
-    sport = packet.tcp.srcport
-    dport = packet.tcp.srcport
+    ip = packet.ip
+    tcp = packet.tcp
+    srcip = ip.src
+    dstip = ip.dst
+    sport = tcp.srcport
+    dport = tcp.dstport
     protocol = None
-    key = '{}:{}_{}:{}'.format(srcip, sport, dstip, dport)
+    key = (srcip, sport, dstip, dport)
     if key in protocol_dict:
         protocol = protocol_dict[key]
+        protocol_dict.move_to_end(key)
+    ssh = packet.ssh
     # hasshServer fields
-    skex = seastc = smastc = scastc = ""
-    if 'kex_algorithms' in packet.ssh.field_names:
-        skex = packet.ssh.kex_algorithms
-    if 'encryption_algorithms_server_to_client' in packet.ssh.field_names:
-        seastc = packet.ssh.encryption_algorithms_server_to_client
-    if 'mac_algorithms_server_to_client' in packet.ssh.field_names:
-        smastc = packet.ssh.mac_algorithms_server_to_client
-    if 'compression_algorithms_server_to_client' in packet.ssh.field_names:
-        scastc = packet.ssh.compression_algorithms_server_to_client
+    skex = getattr(ssh, 'kex_algorithms', '')
+    seastc = getattr(ssh, 'encryption_algorithms_server_to_client', '')
+    smastc = getattr(ssh, 'mac_algorithms_server_to_client', '')
+    scastc = getattr(ssh, 'compression_algorithms_server_to_client', '')
     # Log other kexinit fields (only in JSON)
-    slcts = slstc = seacts = smacts = scacts = sshka = ""
-    if 'languages_client_to_server' in packet.ssh.field_names:
-        slcts = packet.ssh.languages_client_to_server
-    if 'languages_server_to_client' in packet.ssh.field_names:
-        slstc = packet.ssh.languages_server_to_client
-    if 'encryption_algorithms_client_to_server' in packet.ssh.field_names:
-        seacts = packet.ssh.encryption_algorithms_client_to_server
-    if 'mac_algorithms_client_to_server' in packet.ssh.field_names:
-        smacts = packet.ssh.mac_algorithms_client_to_server
-    if 'compression_algorithms_client_to_server' in packet.ssh.field_names:
-        scacts = packet.ssh.compression_algorithms_client_to_server
-    if 'server_host_key_algorithms' in packet.ssh.field_names:
-        sshka = packet.ssh.server_host_key_algorithms
+    slcts = getattr(ssh, 'languages_client_to_server', '')
+    slstc = getattr(ssh, 'languages_server_to_client', '')
+    seacts = getattr(ssh, 'encryption_algorithms_client_to_server', '')
+    smacts = getattr(ssh, 'mac_algorithms_client_to_server', '')
+    scacts = getattr(ssh, 'compression_algorithms_client_to_server', '')
+    sshka = getattr(ssh, 'server_host_key_algorithms', '')
     # Create hasshServer
-    hasshs_str = ';'.join([skex, seastc, smastc, scastc])
-    hasshs = md5(hasshs_str.encode()).hexdigest()
+    hasshs_str, hasshs = hassh_digest(skex, seastc, smastc, scastc)
     record = {"timestamp": packet.sniff_time.isoformat(),
-              "sourceIp": packet.ip.src,
-              "destinationIp": packet.ip.dst,
-              "sourcePort": packet.tcp.srcport,
-              "destinationPort": packet.tcp.dstport,
+              "sourceIp": srcip,
+              "destinationIp": dstip,
+              "sourcePort": sport,
+              "destinationPort": dport,
               "server": protocol,
               "hasshServer": hasshs,
               "hasshServerAlgorithms": hasshs_str,
@@ -266,35 +307,22 @@ def server_hassh(packet):
     return record
 
 
+# hassh function per fingerprint type, indexed by the port order:
+# (srcport < dstport, srcport == dstport, srcport > dstport)
+HASSH_HANDLERS = {'client': (None, None, client_hassh),
+                  'server': (server_hassh, None, None),
+                  'all': (server_hassh, None, client_hassh)}
+
+
 def csv_logging(record):
     """generate output in csv format"""
-    csv_record = ('{ts},{si},{di},{sp},{dp},{t},"{p}",{h},{v},"{ha}",'
-                  '"{k}","{e}","{m}","{c}"')
     if 'hassh' in record:
-        hasshType = 'client'
-        kexAlgs = record['ckex']
-        encAlgs = record['ceacts']
-        macAlgs = record['cmacts']
-        cmpAlgs = record['ccacts']
-        hassh = record['hassh']
-        hasshAlgorithms = record['hasshAlgorithms']
-        identificationString = record['client']
-    elif 'hasshServer' in record:
-        hasshType = 'server'
-        kexAlgs = record['skex']
-        encAlgs = record['seastc']
-        macAlgs = record['smastc']
-        cmpAlgs = record['scastc']
-        hassh = record['hasshServer']
-        hasshAlgorithms = record['hasshServerAlgorithms']
-        identificationString = record['server']
-    csv_record = csv_record.format(
-        ts=record['timestamp'], si=record['sourceIp'],
-        di=record['destinationIp'], sp=record['sourcePort'],
-        dp=record['destinationPort'], t=hasshType, p=identificationString,
-        h=hassh, v=HASSH_VERSION, ha=hasshAlgorithms, k=kexAlgs, e=encAlgs,
-        m=macAlgs, c=cmpAlgs)
-    return csv_record
+        hassh_type, fields = 'client', CLIENT_CSV_FIELDS(record)
+    else:
+        hassh_type, fields = 'server', SERVER_CSV_FIELDS(record)
+    ts, si, di, sp, dp, p, h, ha, k, e, m, c = fields
+    return (f'{ts},{si},{di},{sp},{dp},{hassh_type},"{p}",{h},'
+            f'{HASSH_VERSION},"{ha}","{k}","{e}","{m}","{c}"')
 
 
 def parse_cmd_args():
@@ -316,7 +344,8 @@ def parse_cmd_args():
         help=helptxt)
     helptxt = "a dictionary of {decode_criterion_string: decode_as_protocol} \
         that are used to tell tshark to decode protocols in situations it \
-        wouldn't usually. Default: {'tcp.port==2222': 'ssh'}."
+        wouldn't usually (for live capture only). \
+        Default: {'tcp.port==2222': 'ssh'}."
     parser.add_argument(
         '-da', '--decode_as', type=dict, default=DECODE_AS, help=helptxt)
     helptxt = "BPF capture filter to use (for live capture only).\
@@ -342,12 +371,20 @@ def parse_cmd_args():
 
 
 def setup_logging(logfile):
-    """setup logging"""
+    """setup logging
+
+    Records are queued and written to the file by a background thread so
+    the capture loop never waits on disk I/O.
+    """
     logger = logging.getLogger()
     handler = logging.FileHandler(logfile)
     formatter = logging.Formatter('%(message)s')
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+    log_queue = queue.Queue(-1)
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    logger.addHandler(QueueHandler(log_queue))
     logger.setLevel(logging.INFO)
     return logger
 
@@ -358,25 +395,19 @@ def main():
     setup_logging(args.output_file)
     logger = logging.getLogger()
 
-    csv_header = ("timestamp,sourceIp,destinationIp,sourcePort,"
-                  "destinationPort,hasshType,identificationString,"
-                  "hassh,hasshVersion,hasshAlgorithms,kexAlgs,encAlgs,"
-                  "macAlgs,cmpAlgs")
     if args.log_format == 'csv':
-        logger.info(csv_header)
+        logger.info(CSV_HEADER)
+    # Bound once, looked up per record in the loops below
+    fingerprint = args.fingerprint
+    logf = args.log_format
+    pout = args.print_output
+    output = output_record
 
     # Process PCAP file
     if args.read_file:
-        cap = pyshark.FileCapture(args.read_file, decode_as=args.decode_as)
         try:
-            for packet in cap:
-                process_packet(
-                    packet,
-                    logf=args.log_format,
-                    fingerprint=args.fingerprint,
-                    pout=args.print_output)
-            cap.close()
-            cap.eventloop.stop()
+            for record in process_pcap_file(args.read_file, fingerprint):
+                output(record, logf, pout)
         except Exception as e:
             print('Error: {}'.format(e))
             pass
@@ -384,42 +415,38 @@ def main():
     # Process directory of PCAP files
     elif args.read_directory:
         files = [f.path for f in os.scandir(args.read_directory)
-                 if not f.name.startswith('.') and not f.is_dir()
-                 and (f.name.endswith(".pcap") or f.name.endswith(".pcapng")
-                 or f.name.endswith(".cap"))]
-        for file in files:
-            cap = pyshark.FileCapture(file, decode_as=args.decode_as)
-            try:
-                for packet in cap:
-                    process_packet(
-                        packet,
-                        logf=args.log_format,
-                        fingerprint=args.fingerprint,
-                        pout=args.print_output)
-                cap.close()
-                cap.eventloop.stop()
-            except Exception as e:
-                print('Error: {}'.format(e))
-                pass
+                 if not f.name.startswith('.')
+                 and f.name.endswith(PCAP_EXTENSIONS) and not f.is_dir()]
+        # Files are processed in parallel, logging stays in this process
+        worker = functools.partial(
+            pcap_file_records, fingerprint=fingerprint)
+        with multiprocessing.Pool() as pool:
+            for records in pool.imap_unordered(worker, files):
+                for record in records:
+                    output(record, logf, pout)
 
     # Capture live network traffic
     elif args.interface:
         # TODO: Use a Ring Buffer (LiveRingCapture), when the issue is fixed:
         # https://github.com/KimiNewt/pyshark/issues/299
+        # Note: use_json=True is faster to decode, but pyshark's JsonLayer
+        # only resolves top-level fields and tshark nests message_code and
+        # the KEXINIT algorithms in SSH subtrees, so stay on PDML.
+        # tshark applies the display filter to the written pcap as well,
+        # so only filter in tshark when not saving the capture
+        display_filter = None if args.write_pcap else CAP_DISPLAY_FILTER
         cap = pyshark.LiveCapture(
             interface=args.interface,
             decode_as=args.decode_as,
             bpf_filter=args.bpf_filter,
+            display_filter=display_filter,
             output_file=args.write_pcap)
+        process = process_packet
         try:
             for packet in cap.sniff_continuously(packet_count=0):
-                # if len(protocol_dict) > 10000:
-                # protocol_dict.clear()
-                process_packet(
-                    packet,
-                    logf=args.log_format,
-                    fingerprint=args.fingerprint,
-                    pout=args.print_output)
+                record = process(packet, fingerprint)
+                if record:
+                    output(record, logf, pout)
         except (KeyboardInterrupt, SystemExit):
             print("Exiting..\nBYE o/\n")
 
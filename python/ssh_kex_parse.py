@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+# Copyright (c) 2018, salesforce.com, inc.
+# All rights reserved.
+# Licensed under the BSD 3-Clause license.
+# For full license text, see the LICENSE file in the repo root
+# or https://opensource.org/licenses/BSD-3-Clause
+
+"""Extract SSH identification strings and SSH_MSG_KEXINIT messages from
+pcap/pcapng files without tshark.
+
+TCP payloads are reassembled per direction and parsed per RFC 4253. The
+yielded packets expose the subset of the pyshark packet interface that
+hassh.py consumes (ip, tcp and ssh layers, field_names, sniff_time).
+"""
+
+import socket
+import struct
+from datetime import datetime
+
+import dpkt
+
+SSH_MSG_KEXINIT = 20
+# Ignore streams that do not look like SSH within these limits
+MAX_BANNER_LENGTH = 8192
+MAX_PACKET_LENGTH = 35000
+MAX_PENDING_SEGMENTS = 64
+# tshark shows empty name-lists as '[Empty]'; keep the output identical
+EMPTY_NAMELIST = '[Empty]'
+# Name-lists of SSH_MSG_KEXINIT, in wire order (RFC 4253, section 7.1)
+KEXINIT_FIELDS = ('kex_algorithms',
+                  'server_host_key_algorithms',
+                  'encryption_algorithms_client_to_server',
+                  'encryption_algorithms_server_to_client',
+                  'mac_algorithms_client_to_server',
+                  'mac_algorithms_server_to_client',
+                  'compression_algorithms_client_to_server',
+                  'compression_algorithms_server_to_client',
+                  'languages_client_to_server',
+                  'languages_server_to_client')
+
+PCAPNG_MAGIC = b'\x0a\x0d\x0d\x0a'
+DLT_RAW = (dpkt.pcap.DLT_RAW, 101)
+DLT_NULL = (dpkt.pcap.DLT_NULL, dpkt.pcap.DLT_LOOP)
+
+UINT32 = struct.Struct('>I')
+SSH_PACKET_HEADER = struct.Struct('>IB')
+
+
+class Layer:
+    """a decoded protocol layer, accessed like a pyshark layer"""
+
+    def __init__(self, **fields):
+        self._fields = fields
+
+    @property
+    def field_names(self):
+        return list(self._fields)
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['_fields'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+
+class Packet:
+    """an SSH packet, accessed like a pyshark packet"""
+
+    highest_layer = 'SSH'
+
+    def __init__(self, sniff_time, ip, tcp, ssh):
+        self.sniff_time = sniff_time
+        self.ip = ip
+        self.tcp = tcp
+        self.ssh = ssh
+
+
+class Stream:
+    """reassembly state of one direction of a TCP connection"""
+
+    __slots__ = ('start', 'seq', 'buf', 'pending', 'skipped', 'binary',
+                 'ignored', 'kexinit_seq')
+
+    def __init__(self, seq):
+        self.start = seq
+        self.seq = seq
+        self.buf = b''
+        self.pending = {}
+        # Bytes of (pre-)banner lines consumed so far
+        self.skipped = 0
+        # Set once the banner (or a bare KEXINIT) was seen
+        self.binary = False
+        # Set when the stream turned out not to be SSH
+        self.ignored = False
+        self.kexinit_seq = None
+
+
+def parse_namelists(buf, offset, count):
+    """returns (start, length) pairs of count consecutive name-lists
+    starting at offset, or None if buf is truncated
+    """
+    end = len(buf)
+    namelists = []
+    for _ in range(count):
+        if offset + 4 > end:
+            return None
+        length, = UINT32.unpack_from(buf, offset)
+        offset += 4
+        if offset + length > end:
+            return None
+        namelists.append((offset, length))
+        offset += length
+    return namelists
+
+
+def parse_kexinit(payload):
+    """returns the KEXINIT name-lists as a dict, or None if malformed"""
+    # msg code (1) + cookie (16)
+    namelists = parse_namelists(payload, 17, len(KEXINIT_FIELDS))
+    if namelists is None:
+        return None
+    fields = {}
+    for name, (start, length) in zip(KEXINIT_FIELDS, namelists):
+        value = payload[start:start + length]
+        fields[name] = (value.decode('utf-8', 'replace') if length
+                        else EMPTY_NAMELIST)
+    return fields
+
+
+def starts_with_kexinit(buf):
+    """whether buf starts with the header of a SSH_MSG_KEXINIT packet"""
+    if len(buf) < SSH_PACKET_HEADER.size + 1:
+        return False
+    packet_length, padding_length = SSH_PACKET_HEADER.unpack_from(buf)
+    return (packet_length <= MAX_PACKET_LENGTH and
+            4 <= padding_length < packet_length and
+            buf[SSH_PACKET_HEADER.size] == SSH_MSG_KEXINIT)
+
+
+def process_stream(stream):
+    """consume buffered stream data, returns the SSH fields found.
+
+    Returns None when the stream turns out not to be SSH.
+    """
+    fields = {}
+    while not stream.binary:
+        # The capture may start after the banner
+        if starts_with_kexinit(stream.buf):
+            stream.binary = True
+            break
+        end = stream.buf.find(b'\n')
+        if end < 0:
+            if stream.skipped + len(stream.buf) > MAX_BANNER_LENGTH:
+                return None
+            return fields
+        line = stream.buf[:end].rstrip(b'\r')
+        stream.buf = stream.buf[end + 1:]
+        stream.skipped += end + 1
+        if stream.skipped > MAX_BANNER_LENGTH or b'\x00' in line:
+            return None
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+        # Servers may send other lines before the banner (RFC 4253, 4.2)
+        if line.startswith('SSH-'):
+            stream.binary = True
+            fields['protocol'] = line
+    while len(stream.buf) >= SSH_PACKET_HEADER.size:
+        packet_length, padding_length = SSH_PACKET_HEADER.unpack_from(
+            stream.buf)
+        if packet_length > MAX_PACKET_LENGTH:
+            return None
+        if len(stream.buf) < 4 + packet_length:
+            break
+        payload = stream.buf[5:4 + packet_length - padding_length]
+        stream.buf = stream.buf[4 + packet_length:]
+        if payload and payload[0] == SSH_MSG_KEXINIT:
+            kexinit = parse_kexinit(payload)
+            if kexinit is None:
+                return None
+            fields['message_code'] = str(SSH_MSG_KEXINIT)
+            fields.update(kexinit)
+            # Anything after the first KEXINIT is encrypted
+            stream.buf = b''
+            break
+    return fields
+
+
+def decode_link(datalink, buf):
+    """returns the IP/IP6 packet of a captured frame, or None"""
+    if datalink == dpkt.pcap.DLT_EN10MB:
+        ip = dpkt.ethernet.Ethernet(buf).data
+    elif datalink == dpkt.pcap.DLT_LINUX_SLL:
+        ip = dpkt.sll.SLL(buf).data
+    elif datalink in DLT_NULL:
+        ip = dpkt.loopback.Loopback(buf).data
+    elif datalink in DLT_RAW:
+        if buf[0] >> 4 == 6:
+            ip = dpkt.ip6.IP6(buf)
+        else:
+            ip = dpkt.ip.IP(buf)
+    else:
+        return None
+    if isinstance(ip, (dpkt.ip.IP, dpkt.ip6.IP6)):
+        return ip
+    return None
+
+
+def open_reader(f):
+    """returns a pcap or pcapng reader for the file object"""
+    magic = f.read(4)
+    f.seek(0)
+    if magic == PCAPNG_MAGIC:
+        return dpkt.pcapng.Reader(f)
+    return dpkt.pcap.Reader(f)
+
+
+def read_pcap(pcap):
+    """yields SSH packets carrying an identification string and/or a
+    SSH_MSG_KEXINIT message from a pcap/pcapng file
+    """
+    streams = {}
+    with open(pcap, 'rb') as f:
+        reader = open_reader(f)
+        datalink = reader.datalink()
+        for ts, buf in reader:
+            try:
+                ip = decode_link(datalink, buf)
+            except (dpkt.UnpackError, IndexError):
+                continue
+            if ip is None or not isinstance(ip.data, dpkt.tcp.TCP):
+                continue
+            tcp = ip.data
+            key = (ip.src, tcp.sport, ip.dst, tcp.dport)
+            if tcp.flags & dpkt.tcp.TH_SYN:
+                # A new connection, possibly reusing the 4-tuple
+                streams.pop(key, None)
+            closing = tcp.flags & (dpkt.tcp.TH_FIN | dpkt.tcp.TH_RST)
+            if closing:
+                # The connection ends with this segment
+                stream = streams.pop(key, None)
+            else:
+                stream = streams.get(key)
+            if not tcp.data:
+                continue
+            if (stream is not None and tcp.data.startswith(b'SSH-') and
+                    tcp.seq != stream.start and tcp.seq != stream.seq):
+                # A new connection reusing the 4-tuple, without a SYN
+                stream = None
+            if stream is None:
+                stream = Stream(tcp.seq)
+                if not closing:
+                    streams[key] = stream
+            if stream.ignored:
+                continue
+            tcp_fields = {'srcport': str(tcp.sport),
+                          'dstport': str(tcp.dport)}
+            if stream.kexinit_seq is not None:
+                # Only the first KEXINIT is in the clear
+                if tcp.seq != stream.kexinit_seq:
+                    continue
+                tcp_fields['analysis_retransmission'] = ''
+                fields = {'message_code': str(SSH_MSG_KEXINIT)}
+            else:
+                offset = (tcp.seq - stream.seq) & 0xffffffff
+                if offset:
+                    # Buffer out-of-order segments, drop retransmissions
+                    if (offset < 0x80000000 and
+                            len(stream.pending) < MAX_PENDING_SEGMENTS):
+                        stream.pending[tcp.seq] = tcp.data
+                    continue
+                data = tcp.data
+                while data is not None:
+                    stream.buf += data
+                    stream.seq = (stream.seq + len(data)) & 0xffffffff
+                    data = stream.pending.pop(stream.seq, None)
+                fields = process_stream(stream)
+                if fields is None:
+                    # Not SSH: skip the rest of the connection
+                    stream.ignored = True
+                    stream.buf = b''
+                    stream.pending.clear()
+                    continue
+                if 'message_code' in fields:
+                    stream.kexinit_seq = tcp.seq
+                    stream.pending.clear()
+                if not fields:
+                    continue
+            family = socket.AF_INET6 if isinstance(ip, dpkt.ip6.IP6) \
+                else socket.AF_INET
+            yield Packet(
+                sniff_time=datetime.fromtimestamp(ts),
+                ip=Layer(src=socket.inet_ntop(family, ip.src),
+                         dst=socket.inet_ntop(family, ip.dst)),
+                tcp=Layer(**tcp_fields),
+                ssh=Layer(**fields))
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# hassh.py and ssh_kex_parse.py are scripts, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,178 @@
+import json
+import os
+import socket
+import struct
+
+import dpkt
+import pytest
+
+import hassh
+import ssh_kex_parse
+
+FINGERPRINTS = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'hasshGen', 'hassh_fingerprints.json')
+
+CLIENT = ('10.0.0.1', 50000)
+SERVER = ('10.0.0.2', 22)
+CLIENT_BANNER = b'SSH-2.0-OpenSSH_7.6\r\n'
+SERVER_BANNER = b'SSH-2.0-OpenSSH_7.2p2 Ubuntu-4ubuntu2.4\r\n'
+CLIENT_LISTS = ('curve25519-sha256,ext-info-c', 'ssh-ed25519',
+                'aes128-ctr', 'aes128-ctr', 'hmac-sha1', 'hmac-sha1',
+                'none,zlib', 'none', '', '')
+
+
+@pytest.fixture(autouse=True)
+def clear_protocol_dict():
+    hassh.protocol_dict.clear()
+
+
+def kexinit(namelists):
+    """returns a SSH_MSG_KEXINIT binary packet"""
+    payload = bytes([20]) + b'\x00' * 16
+    for namelist in namelists:
+        namelist = namelist.encode()
+        payload += struct.pack('>I', len(namelist)) + namelist
+    # first_kex_packet_follows, reserved
+    payload += b'\x00' * 5
+    padding = 8 - (len(payload) + 5) % 8 + 8
+    body = bytes([padding]) + payload + b'\x00' * padding
+    return struct.pack('>I', len(body)) + body
+
+
+def segment(src, dst, seq, data=b'', flags=dpkt.tcp.TH_ACK, ts=1.0):
+    """returns a (timestamp, ethernet frame) tuple"""
+    tcp = dpkt.tcp.TCP(sport=src[1], dport=dst[1], seq=seq, flags=flags,
+                       data=data)
+    ip = dpkt.ip.IP(src=socket.inet_aton(src[0]),
+                    dst=socket.inet_aton(dst[0]), p=dpkt.ip.IP_PROTO_TCP,
+                    data=tcp)
+    ip.len = len(bytes(ip))
+    eth = dpkt.ethernet.Ethernet(src=b'\x00' * 6, dst=b'\x01' * 6,
+                                 type=dpkt.ethernet.ETH_TYPE_IP, data=ip)
+    return ts, bytes(eth)
+
+
+def write_pcap(path, frames):
+    with open(str(path), 'wb') as f:
+        writer = dpkt.pcap.Writer(f)
+        for ts, frame in frames:
+            writer.writepkt(frame, ts)
+    return str(path)
+
+
+def ssh_fields(packet):
+    return {name: getattr(packet.ssh, name)
+            for name in packet.ssh.field_names}
+
+
+def test_banner_and_kexinit_in_one_segment(tmp_path):
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, CLIENT_BANNER + kexinit(CLIENT_LISTS))])
+    packets = list(ssh_kex_parse.read_pcap(pcap))
+    assert len(packets) == 1
+    fields = ssh_fields(packets[0])
+    assert fields['protocol'] == 'SSH-2.0-OpenSSH_7.6'
+    assert fields['message_code'] == '20'
+    assert fields['kex_algorithms'] == 'curve25519-sha256,ext-info-c'
+    assert fields['compression_algorithms_client_to_server'] == 'none,zlib'
+    assert packets[0].ip.src == '10.0.0.1'
+    assert packets[0].tcp.srcport == '50000'
+    assert packets[0].tcp.dstport == '22'
+
+
+def test_kexinit_split_across_segments(tmp_path):
+    kex = kexinit(CLIENT_LISTS)
+    seq = 1000 + len(CLIENT_BANNER)
+    # The second half arrives first
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, CLIENT_BANNER),
+        segment(CLIENT, SERVER, seq + 10, kex[10:]),
+        segment(CLIENT, SERVER, seq, kex[:10])])
+    packets = list(ssh_kex_parse.read_pcap(pcap))
+    assert [ssh_fields(p).get('protocol') for p in packets] == [
+        'SSH-2.0-OpenSSH_7.6', None]
+    assert ssh_fields(packets[1])['mac_algorithms_client_to_server'] == \
+        'hmac-sha1'
+
+
+def test_retransmitted_kexinit_is_an_event(tmp_path):
+    seq = 1000 + len(CLIENT_BANNER)
+    kex = segment(CLIENT, SERVER, seq, kexinit(CLIENT_LISTS))
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, CLIENT_BANNER), kex, kex])
+    records = list(hassh.process_pcap_file(pcap, 'all'))
+    assert len(records) == 2
+    assert records[0]['hassh']
+    assert records[1]['eventType'] == 'retransmission'
+
+
+def test_empty_namelists(tmp_path):
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, CLIENT_BANNER + kexinit(CLIENT_LISTS))])
+    fields = ssh_fields(next(ssh_kex_parse.read_pcap(pcap)))
+    assert fields['languages_client_to_server'] == '[Empty]'
+    assert fields['languages_server_to_client'] == '[Empty]'
+
+
+def test_known_hassh(tmp_path):
+    with open(FINGERPRINTS) as f:
+        known = json.loads(f.readline())
+    # The fingerprint database does not record the host key algorithms
+    known['cshka'] = 'ssh-ed25519'
+    namelists = [known[k] for k in ('ckex', 'cshka', 'ceacts', 'ceastc',
+                                    'cmacts', 'cmastc', 'ccacts', 'ccastc',
+                                    'clcts', 'clstc')]
+    namelists = ['' if n == '[Empty]' else n for n in namelists]
+    banner = known['clientIdentificationString'].encode() + b'\r\n'
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, banner + kexinit(namelists))])
+    record, = hassh.process_pcap_file(pcap, 'all')
+    assert record['hassh'] == known['hassh']
+    assert record['hasshAlgorithms'] == known['hasshAlgorithms']
+    assert record['client'] == known['clientIdentificationString']
+
+
+def test_server_with_pre_banner_lines(tmp_path):
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(SERVER, CLIENT, 5000,
+                b'Welcome\r\nno SSH here\r\n' + SERVER_BANNER +
+                kexinit(CLIENT_LISTS))])
+    record, = hassh.process_pcap_file(pcap, 'all')
+    assert record['server'] == 'SSH-2.0-OpenSSH_7.2p2 Ubuntu-4ubuntu2.4'
+    assert record['hasshServer']
+
+
+def test_capture_starting_after_the_banner(tmp_path):
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, SERVER, 1000, kexinit(CLIENT_LISTS))])
+    record, = hassh.process_pcap_file(pcap, 'all')
+    assert record['client'] is None
+    assert record['hasshAlgorithms'] == \
+        'curve25519-sha256,ext-info-c;aes128-ctr;hmac-sha1;none,zlib'
+
+
+def test_reused_connection_tuple(tmp_path):
+    frames = []
+    # A new connection on the same 4-tuple: after FIN, on SYN only, and
+    # with neither (a new banner at an unrelated seq)
+    for isn, syn, fin in ((1000, True, True), (700000, True, False),
+                          (9000000, False, False)):
+        if syn:
+            frames.append(segment(CLIENT, SERVER, isn, flags=dpkt.tcp.TH_SYN))
+        frames.append(segment(CLIENT, SERVER, isn + 1,
+                              CLIENT_BANNER + kexinit(CLIENT_LISTS)))
+        if fin:
+            frames.append(segment(CLIENT, SERVER, isn + 2000,
+                                  flags=dpkt.tcp.TH_FIN | dpkt.tcp.TH_ACK))
+    pcap = write_pcap(tmp_path / 'a.pcap', frames)
+    records = list(hassh.process_pcap_file(pcap, 'all'))
+    assert len(records) == 3
+    assert all('hassh' in r for r in records)
+
+
+def test_non_ssh_stream_is_ignored(tmp_path):
+    pcap = write_pcap(tmp_path / 'a.pcap', [
+        segment(CLIENT, ('10.0.0.2', 80), 1000,
+                b'GET / HTTP/1.1\r\nHost: x\r\n\r\n'),
+        segment(CLIENT, ('10.0.0.2', 80), 1026, bytes(range(256)) * 4)])
+    assert list(ssh_kex_parse.read_pcap(pcap)) == []